@@ -10,23 +10,36 @@ GitHub Secrets required:
   DISCORD_USER_ID    - Your Discord user ID (for DMs)
 """
 
-import json
+import functools
+import html
+import importlib.util
+import operator
 import os
 import re
 import sys
+import threading
 import time
-from collections import Counter
-from datetime import datetime, timezone
+from bisect import bisect_right
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
 from pathlib import Path
 
-try:
-    import requests
-    from bs4 import BeautifulSoup
-except ImportError:
+# Install missing dependencies on a fresh runner (find_spec only locates the
+# modules, nothing is imported until every one of them is present)
+_DEPENDENCIES = {"requests": "requests", "lxml": "lxml", "orjson": "orjson"}
+_missing = [pkg for mod, pkg in _DEPENDENCIES.items() if importlib.util.find_spec(mod) is None]
+if _missing:
     import subprocess
-    subprocess.check_call([sys.executable, "-m", "pip", "install", "requests", "beautifulsoup4"])
-    import requests
-    from bs4 import BeautifulSoup
+    subprocess.check_call([sys.executable, "-m", "pip", "install", *_missing])
+    importlib.invalidate_caches()
+
+import lxml.etree
+import lxml.html
+import orjson
+import requests
+from urllib3.util import Retry
 
 
 # --- Configuration ---
@@ -60,6 +73,8 @@ REGISTRATIONS = [
 
 SCHEDULE_FILE = Path(__file__).parent / "plan.ics"
 STATE_FILE = Path(__file__).parent / "previous_state.json"
+COOKIE_FILE = Path(__file__).parent / ".usos_cookies.json"  # reused USOS login, never commit
+PRETTY_STATE = False  # True = indented previous_state.json (debugging; slower, ~2x larger)
 
 USERNAME = os.environ.get("USOS_USERNAME", "")
 PASSWORD = os.environ.get("USOS_PASSWORD", "")
@@ -81,23 +96,61 @@ DAYS_PL = {
 # (filters out one-off substitutions, semester-edge anomalies, etc.)
 MIN_OCCURRENCES = 3
 
+# Scraping politeness: at most MAX_WORKERS requests to USOS in flight, and
+# consecutive requests start at least REQUEST_INTERVAL seconds apart
+MAX_WORKERS = 8
+REQUEST_INTERVAL = 0.1
+
+# Patterns used inside the parsing loops, compiled once
+_NON_DIGIT_RE = re.compile(r"[^\d]")
+_TERMIN_RE = re.compile(r"(\w+)\s+(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})")  # "Środa 10:15 - 11:45"
+
 
 # --- ICS Schedule Parser ---
-def _unfold_ics(text):
-    """Unfold ICS continuation lines (RFC 5545: lines starting with space/tab)."""
-    result = []
-    for line in text.splitlines():
-        if line.startswith((" ", "\t")) and result:
-            result[-1] += line[1:]
+def _unfold_ics(lines):
+    """Yield logical ICS lines, unfolding continuations (RFC 5545: lines starting with space/tab)."""
+    pending = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line.startswith((" ", "\t")) and pending is not None:
+            pending += line[1:]
         else:
-            result.append(line)
-    return "\n".join(result)
+            if pending is not None:
+                yield pending
+            pending = line
+    if pending is not None:
+        yield pending
+
+
+def _event_slot(dtstart, dtend):
+    """(weekday, start_min, end_min) of a VEVENT, or None if its times are missing or invalid."""
+    # Fixed-width YYYYMMDDTHHMMSS: slicing is far cheaper than strptime, and
+    # only the start date's weekday plus both HH:MM are needed
+    if len(dtstart) < 15 or len(dtend) < 15 or dtstart[8] != "T" or dtend[8] != "T":
+        return None
+    try:
+        weekday = date(int(dtstart[0:4]), int(dtstart[4:6]), int(dtstart[6:8])).weekday()
+        start_min = int(dtstart[9:11]) * 60 + int(dtstart[11:13])
+        end_min = int(dtend[9:11]) * 60 + int(dtend[11:13])
+    except ValueError:
+        return None
+    return weekday, start_min, end_min
 
 
 def _time_to_minutes(t):
-    """Convert HH:MM string to minutes since midnight."""
-    h, m = t.strip().split(":")
-    return int(h) * 60 + int(m)
+    """Convert H:MM / HH:MM string to minutes since midnight."""
+    return int(t[:-3]) * 60 + int(t[-2:])
+
+
+def _merge_slots(slots):
+    """Sort (start, end) slots, merge overlapping ones, return (starts, ends) tuples."""
+    merged = []
+    for start, end in sorted(slots):
+        if merged and start < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return tuple(s for s, _ in merged), tuple(e for _, e in merged)
 
 
 def load_schedule_from_ics(ics_path):
@@ -107,101 +160,190 @@ def load_schedule_from_ics(ics_path):
     Counts how many times each (weekday, start, end) slot appears across the
     semester. Slots with >= MIN_OCCURRENCES are kept as regular classes.
 
-    Returns list of (day_pl, start_min, end_min) tuples.
+    Returns {day_pl: (starts, ends)}: each day's slots merged where they
+    overlap and sorted, as parallel tuples of minutes (see has_conflict).
+    The result is cached until the file changes, so callers must not modify it.
     """
-    with open(ics_path, encoding="utf-8") as f:
-        text = f.read()
-
-    text = _unfold_ics(text)
-    slot_counts = Counter()
-
-    for block in re.split(r"BEGIN:VEVENT", text)[1:]:
-        block = block.split("END:VEVENT")[0]
-        props = {}
-        for line in block.splitlines():
-            if ":" in line:
-                key, _, val = line.partition(":")
-                props[key.split(";")[0].strip()] = val.strip()
-
-        dtstart = props.get("DTSTART", "")
-        dtend = props.get("DTEND", "")
-        if not dtstart or not dtend:
-            continue
-        try:
-            ds = datetime.strptime(dtstart[:15], "%Y%m%dT%H%M%S")
-            de = datetime.strptime(dtend[:15], "%Y%m%dT%H%M%S")
-        except ValueError:
-            continue
+    return _load_schedule_cached(ics_path, ics_path.stat().st_mtime_ns)
+
 
-        slot_counts[(ds.weekday(), ds.strftime("%H:%M"), de.strftime("%H:%M"))] += 1
+@functools.lru_cache(maxsize=4)
+def _load_schedule_cached(ics_path, mtime_ns):
+    # mtime_ns is only part of the cache key: editing plan.ics invalidates it
+    slot_counts = defaultdict(int)
 
-    schedule = []
-    for (weekday, start_str, end_str), count in slot_counts.items():
+    # Stream the file through a small state machine: only DTSTART/DTEND of
+    # the current VEVENT are kept, everything else is dropped as it is read
+    in_event = False
+    dtstart = dtend = ""
+    with open(ics_path, encoding="utf-8") as f:
+        for line in _unfold_ics(f):
+            # SUMMARY, DESCRIPTION, UID, LOCATION, ... are skipped before any splitting
+            if not line.startswith(("BEGIN", "END", "DTSTART", "DTEND")):
+                continue
+            key, _, val = line.partition(":")
+            name = key.split(";")[0].strip()
+            if name == "BEGIN" and val.strip() == "VEVENT":
+                in_event = True
+                dtstart = dtend = ""
+            elif not in_event:
+                continue
+            elif name == "DTSTART":
+                dtstart = val.strip()
+            elif name == "DTEND":
+                dtend = val.strip()
+            elif name == "END" and val.strip() == "VEVENT":
+                in_event = False
+                slot = _event_slot(dtstart, dtend)
+                if slot:
+                    slot_counts[slot] += 1
+
+    slots_by_day = {}
+    n_slots = 0
+    for (weekday, start_min, end_min), count in slot_counts.items():
         if count >= MIN_OCCURRENCES:
-            schedule.append((DAYS_PL[weekday], _time_to_minutes(start_str), _time_to_minutes(end_str)))
+            slots_by_day.setdefault(DAYS_PL[weekday], []).append((start_min, end_min))
+            n_slots += 1
+    schedule = {day: _merge_slots(slots) for day, slots in slots_by_day.items()}
 
-    print(f"  Wczytano {len(schedule)} regularnych slotow z {ics_path.name} "
+    print(f"  Wczytano {n_slots} regularnych slotow z {ics_path.name} "
           f"(prog: >={MIN_OCCURRENCES} wystapien)")
     return schedule
 
 
+# --- Groups ---
+@dataclass(slots=True)
+class Group:
+    """One weekly meeting of a USOS group (a group meeting twice a week yields two)."""
+    przedmiot: str
+    kod_przedmiotu: str
+    grupa: str
+    prowadzacy: str
+    dzien: str
+    godz_start: str
+    godz_end: str
+    miejsce: str
+    opis: str
+    zapisanych: int
+    limit: int
+    wolne: int = field(init=False)
+    start_min: int = field(init=False)  # godz_start/godz_end as minutes since midnight
+    end_min: int = field(init=False)
+
+    def __post_init__(self):
+        self.wolne = self.limit - self.zapisanych
+        self.start_min = _time_to_minutes(self.godz_start)
+        self.end_min = _time_to_minutes(self.godz_end)
+
+
 # --- Schedule conflict detection ---
-def has_conflict(group, schedule):
-    """Return True if the group's time slot overlaps any slot in schedule."""
-    try:
-        g_start = _time_to_minutes(group["godz_start"])
-        g_end = _time_to_minutes(group["godz_end"])
-    except (ValueError, KeyError):
+def has_conflict(group, day_slots):
+    """Return True if the group's time slot overlaps any of day_slots (schedule[group.dzien])."""
+    if not day_slots:
         return False
-    g_dzien = group.get("dzien", "").strip()
-    for s_dzien, s_start, s_end in schedule:
-        if g_dzien == s_dzien and g_start < s_end and g_end > s_start:
-            return True
-    return False
+    starts, ends = day_slots
+    # Merged slots are disjoint, so ends is sorted as well: the first slot
+    # ending after the group starts is the only one that can overlap it
+    i = bisect_right(ends, group.start_min)
+    return i < len(ends) and starts[i] < group.end_min
 
 
 # --- Discord Bot DM ---
 DISCORD_API = "https://discord.com/api/v10"
 
+# The DM channel id for a (bot, user) pair never changes, so it is cached in
+# memory and on disk instead of being re-created before every message
+DM_CHANNEL_FILE = Path(__file__).parent / ".dm_channel"
+_dm_channel_id = None
 
-def discord_dm(embed):
-    """Send an embed DM to the configured user via Discord bot."""
-    if not DISCORD_BOT_TOKEN or not DISCORD_USER_ID:
-        print("  [SKIP] Brak DISCORD_BOT_TOKEN lub DISCORD_USER_ID")
-        return
+# Discord accepts up to 10 embeds and 6000 embed characters per message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+
+# Embeds queued by send_notification, sent together by flush_notifications
+_pending_embeds = []
+
+
+def _cached_dm_channel():
+    """Return the cached DM channel id for DISCORD_USER_ID, or None."""
+    global _dm_channel_id
+    if _dm_channel_id is None and DM_CHANNEL_FILE.exists():
+        try:
+            with open(DM_CHANNEL_FILE, "rb") as f:
+                cached = orjson.loads(f.read())
+            if cached.get("user_id") == DISCORD_USER_ID:
+                _dm_channel_id = cached.get("channel_id")
+        except (orjson.JSONDecodeError, IOError, AttributeError):
+            pass
+    return _dm_channel_id
 
-    headers = {
-        "Authorization": f"Bot {DISCORD_BOT_TOKEN}",
-        "Content-Type": "application/json",
-    }
 
+def _open_dm_channel(headers):
+    """Open the DM channel with DISCORD_USER_ID and cache its id. Returns None on failure."""
+    global _dm_channel_id
     try:
         ch = requests.post(
             f"{DISCORD_API}/users/@me/channels",
-            json={"recipient_id": DISCORD_USER_ID},
+            data=orjson.dumps({"recipient_id": DISCORD_USER_ID}),
             headers=headers, timeout=10,
         )
         if ch.status_code != 200:
             print(f"  Discord: blad DM channel: {ch.status_code}")
-            return
-        channel_id = ch.json()["id"]
+            return None
+        _dm_channel_id = orjson.loads(ch.content)["id"]
     except Exception as e:
         print(f"  Discord: wyjatek - {e}")
-        return
+        return None
 
     try:
-        msg = requests.post(
+        with open(DM_CHANNEL_FILE, "wb") as f:
+            f.write(orjson.dumps({"user_id": DISCORD_USER_ID, "channel_id": _dm_channel_id}))
+    except IOError:
+        pass
+    return _dm_channel_id
+
+
+def discord_dm(embeds):
+    """Send a DM with the given embeds (one message) to the configured user via Discord bot."""
+    if not DISCORD_BOT_TOKEN or not DISCORD_USER_ID:
+        print("  [SKIP] Brak DISCORD_BOT_TOKEN lub DISCORD_USER_ID")
+        return
+
+    headers = {
+        "Authorization": f"Bot {DISCORD_BOT_TOKEN}",
+        "Content-Type": "application/json",
+    }
+
+    channel_id = _cached_dm_channel()
+    from_cache = channel_id is not None
+    if not from_cache:
+        channel_id = _open_dm_channel(headers)
+    if not channel_id:
+        return
+
+    def post_message(channel_id):
+        return requests.post(
             f"{DISCORD_API}/channels/{channel_id}/messages",
-            json={"embeds": [embed]},
+            data=orjson.dumps({"embeds": embeds}),
             headers=headers, timeout=10,
         )
+
+    try:
+        msg = post_message(channel_id)
+        if from_cache and msg.status_code in (403, 404):
+            # Stale cache (bot token or recipient changed) - reopen the channel once
+            channel_id = _open_dm_channel(headers)
+            if not channel_id:
+                return
+            msg = post_message(channel_id)
         print("  Discord DM: wyslano" if msg.status_code in (200, 201)
               else f"  Discord DM: blad {msg.status_code}")
     except Exception as e:
         print(f"  Discord: wyjatek - {e}")
 
 
-def send_notification(title, description, color=0x00FF00, fields=None):
+def build_embed(title, description, color=0x00FF00, fields=None):
+    """Return a Discord embed dict (at most 25 fields, Discord's limit)."""
     embed = {
         "title": title,
         "description": description,
@@ -211,10 +353,70 @@ def send_notification(title, description, color=0x00FF00, fields=None):
     }
     if fields:
         embed["fields"] = fields[:25]
-    discord_dm(embed)
+    return embed
+
+
+def send_notification(title, description, color=0x00FF00, fields=None):
+    """Queue an embed; everything queued goes out in as few DMs as possible on flush_notifications()."""
+    _pending_embeds.append(build_embed(title, description, color, fields))
+
+
+def _embed_chars(embed):
+    """Characters counted against Discord's per-message embed limit."""
+    return (len(embed.get("title", "")) + len(embed.get("description", ""))
+            + len(embed.get("footer", {}).get("text", ""))
+            + sum(len(f["name"]) + len(f["value"]) for f in embed.get("fields", ())))
+
+
+def flush_notifications():
+    """Send all queued embeds, packing as many into each DM as Discord allows."""
+    batch, chars = [], 0
+    for embed in _pending_embeds:
+        n = _embed_chars(embed)
+        if batch and (len(batch) == MAX_EMBEDS_PER_MESSAGE or chars + n > MAX_EMBED_CHARS_PER_MESSAGE):
+            discord_dm(batch)
+            batch, chars = [], 0
+        batch.append(embed)
+        chars += n
+    if batch:
+        discord_dm(batch)
+    _pending_embeds.clear()
+
+
+# --- HTTP session ---
+def create_session():
+    """
+    requests.Session tuned for many back-to-back requests to one host.
+
+    The pool holds a kept-alive connection per scraping thread, so TCP+TLS
+    setup happens once per connection instead of per request; transient
+    429/5xx responses are retried with backoff.
+    """
+    session = requests.Session()
+    session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"})
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504))
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)  # plain-http redirect hops get the same pool/retries
+    return session
 
 
 # --- CAS Login ---
+# The login pages are small and only a handful of tags matter, so they are
+# picked out with regexes instead of building a whole document tree
+_A_TAG_RE = re.compile(r"<a\s[^>]*>", re.I)
+_META_TAG_RE = re.compile(r"<meta\s[^>]*>", re.I)
+_FORM_RE = re.compile(r"<form\b([^>]*)>(.*?)(?:</form>|$)", re.I | re.S)
+_INPUT_TAG_RE = re.compile(r"<input\s[^>]*>", re.I)
+_ATTR_RE = re.compile(r"""([\w-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+_REFRESH_URL_RE = re.compile(r"url\s*=\s*(.*)", re.I | re.S)
+
+
+def _attrs(tag):
+    """Attributes of an HTML start tag as {lowercased name: unescaped value}."""
+    return {name.lower(): html.unescape(dq or sq or bare) for name, dq, sq, bare in _ATTR_RE.findall(tag)}
+
+
 def cas_login(session):
     from urllib.parse import urlparse
     print("Logowanie do USOS via CAS...")
@@ -223,35 +425,35 @@ def cas_login(session):
     cas_page_url = resp.url
 
     if "cas.usos.pw.edu.pl" not in cas_page_url:
-        soup = BeautifulSoup(resp.text, "html.parser")
-        cas_link = None
-        for a in soup.find_all("a", href=True):
-            if "cas" in a["href"].lower():
-                cas_link = a["href"]
+        page = resp.content.decode("utf-8", "replace")
+        cas_link = next((href for href in (_attrs(t).get("href") for t in _A_TAG_RE.findall(page))
+                         if href and "cas" in href.lower()), None)
+        for tag in _META_TAG_RE.findall(page):
+            meta = _attrs(tag)
+            if meta.get("http-equiv", "").lower() == "refresh":
+                m = _REFRESH_URL_RE.search(meta.get("content", ""))
+                if m:
+                    cas_link = m.group(1).strip("'\" ")
                 break
-        meta = soup.find("meta", attrs={"http-equiv": "refresh"})
-        if meta:
-            content = meta.get("content", "")
-            if "url=" in content.lower():
-                cas_link = content.split("url=", 1)[-1].strip("'\" ")
         if not cas_link:
             service_url = f"{BASE_URL}?_action=logowaniecas/index"
             cas_link = f"{CAS_URL}?service={requests.utils.quote(service_url, safe='')}"
         resp = session.get(cas_link, allow_redirects=True)
         cas_page_url = resp.url
 
-    soup = BeautifulSoup(resp.text, "html.parser")
-    form = soup.find("form")
-    if not form:
+    form_m = _FORM_RE.search(resp.content.decode("utf-8", "replace"))
+    if not form_m:
         print("ERROR: Could not find login form")
         return False
 
     execution = ""
-    for inp in form.find_all("input", {"type": "hidden"}):
-        if inp.get("name") == "execution":
-            execution = inp.get("value", "")
+    for tag in _INPUT_TAG_RE.findall(form_m.group(2)):
+        field_attrs = _attrs(tag)
+        if field_attrs.get("name") == "execution" and field_attrs.get("type", "").lower() == "hidden":
+            execution = field_attrs.get("value", "")
+            break
 
-    form_action = form.get("action", "")
+    form_action = _attrs(form_m.group(1)).get("action", "")
     if form_action.startswith("/"):
         parsed = urlparse(cas_page_url)
         form_action = f"{parsed.scheme}://{parsed.netloc}{form_action}"
@@ -265,32 +467,134 @@ def cas_login(session):
         "username": USERNAME, "password": PASSWORD,
         "execution": execution, "_eventId": "submit", "geolocation": "",
     }, allow_redirects=True)
-    resp.encoding = "utf-8"
 
-    if "wyloguj" in resp.text.lower() or "zalogowany" in resp.text.lower():
+    # Markers are ASCII, so bytes.lower() matches without decoding the page
+    body = resp.content.lower()
+    if b"wyloguj" in body or b"zalogowany" in body:
         print("  OK - zalogowano!")
         return True
-    check = session.get(f"{BASE_URL}?_action=dla_stud/rejestracja/kalendarz")
-    if "wyloguj" in check.text.lower() or "kalendarz rejestracji" in check.text.lower():
+    body = session.get(f"{BASE_URL}?_action=dla_stud/rejestracja/kalendarz").content.lower()
+    if b"wyloguj" in body or b"kalendarz rejestracji" in body:
         print("  OK - zalogowano!")
         return True
     print("  BLAD: Nie udalo sie zalogowac")
     return False
 
 
+def load_cookies(session, path):
+    """
+    Restore cookies saved by save_cookies and check they still hold a live
+    USOS login. Returns True if the session can skip cas_login.
+    """
+    if not path.exists():
+        return False
+    try:
+        with open(path, "rb") as f:
+            for c in orjson.loads(f.read()):
+                session.cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"],
+                                    secure=c["secure"], expires=c["expires"])
+    except (orjson.JSONDecodeError, IOError, KeyError, TypeError):
+        return False
+    body = session.get(f"{BASE_URL}?_action=dla_stud/rejestracja/kalendarz").content.lower()
+    if b"wyloguj" in body:
+        print("Sesja USOS z poprzedniego uruchomienia aktywna - pomijam logowanie")
+        return True
+    session.cookies.clear()
+    return False
+
+
+def save_cookies(session, path):
+    """Persist the session cookies (owner-only file: they are a live login)."""
+    cookies = [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                "secure": c.secure, "expires": c.expires} for c in session.cookies]
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps(cookies))
+    except OSError as e:
+        print(f"  Nie udalo sie zapisac ciasteczek: {e}")
+
+
 # --- USOS Scraping ---
+# A USOS page larger than this is not a registration page; stop reading it
+MAX_PAGE_BYTES = 8 * 1024 * 1024
+
+_throttle_lock = threading.Lock()
+_next_request_at = 0.0
+
+
+def _throttle():
+    """Block until the next request slot (shared by all scraping threads)."""
+    global _next_request_at
+    with _throttle_lock:
+        now = time.monotonic()
+        wait = _next_request_at - now
+        _next_request_at = max(now, _next_request_at) + REQUEST_INTERVAL
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _fetch_html(session, url):
+    """
+    GET a USOS page and parse it while the body is still streaming in.
+
+    Chunks go straight into lxml's feed parser (USOS always serves UTF-8, so
+    no charset detection or str round-trip), overlapping parsing with the
+    download. Returns the root element, or None for empty or oversized pages.
+    """
+    _throttle()
+    parser = lxml.html.HTMLParser(encoding="utf-8")  # feed state is per page
+    size = 0
+    with session.get(url, stream=True) as resp:
+        for chunk in resp.iter_content(chunk_size=64 * 1024):
+            size += len(chunk)
+            if size > MAX_PAGE_BYTES:
+                print(f"  BLAD: strona przekracza {MAX_PAGE_BYTES} B, pomijam: {url}")
+                return None
+            parser.feed(chunk)
+    return parser.close() if size else None
+
+
+def _text(node, separator=""):
+    """Stripped text of node and its descendants (each text piece stripped, empty ones dropped)."""
+    if not len(node):  # leaf cell (most of them): its own text is the whole text
+        return node.text.strip() if node.text else ""
+    return separator.join(s for s in (t.strip() for t in node.itertext()) if s)
+
+
+def _parse_count(text):
+    """Integer from a count cell ("20 os." -> 20), 0 if it has no digits."""
+    # Only \d characters survive the sub, and int() accepts all of them
+    return int(_NON_DIGIT_RE.sub("", text) or "0")
+
+
+def _has_class(cls):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')"
+
+
+# XPath expressions compiled once instead of being re-parsed by libxml2 per page
+_SUBJECT_ROWS_XP = lxml.etree.XPath("//tr[@id]")
+_GREY_TABLE_XP = lxml.etree.XPath(f"//table[{_has_class('grey')}]")
+# Fallback: first table with a text node mentioning the lecturer column
+_PROWADZ_TABLE_XP = lxml.etree.XPath(
+    "//table[.//text()[contains(., 'Prowadzący') or contains(., 'prowadzący')]]")
+_HEADNOTE_ROW_XP = lxml.etree.XPath(f".//tr[{_has_class('headnote')}]")
+_HEADER_CELLS_XP = lxml.etree.XPath(".//th|.//td")
+
+
 def get_subjects(session, rej_kod):
     url = f"{BASE_URL}?_action=dla_stud/rejestracja/brdg2/wyborPrzedmiotu&rej_kod={rej_kod}"
-    soup = BeautifulSoup(session.get(url).text, "html.parser")
+    doc = _fetch_html(session, url)
     subjects = []
-    for row in soup.select("tr[id]"):
-        cells = row.find_all("td")
+    if doc is None:
+        return subjects
+    for row in _SUBJECT_ROWS_XP(doc):
+        cells = row.findall(".//td")
         if len(cells) < 3:
             continue
-        link = cells[0].find("a")
-        if link:
-            subjects.append({"name": link.get_text(strip=True), "code": row.get("id", "")})
-    print(f"  Znaleziono {len(subjects)} przedmiotow")
+        link = cells[0].find(".//a")
+        if link is not None:
+            subjects.append({"name": _text(link), "code": row.get("id", "")})
     return subjects
 
 
@@ -300,29 +604,26 @@ def get_groups(session, subject, rej_kod, cdyd_kod):
         f"&rej_kod={rej_kod}&prz_kod={subject['code']}"
         f"&cdyd_kod={cdyd_kod}&odczyt=1&showLocationColumn=on&formFlag=1"
     )
-    soup = BeautifulSoup(session.get(url).text, "html.parser")
+    doc = _fetch_html(session, url)
     groups = []
+    if doc is None:
+        return groups
 
-    table = soup.find("table", class_="grey")
-    if not table:
-        for t in soup.find_all("table"):
-            if t.find(string=re.compile("Prowadzący|prowadzący")):
-                table = t
-                break
-    if not table:
+    table = next(iter(_GREY_TABLE_XP(doc) or _PROWADZ_TABLE_XP(doc)), None)
+    if table is None:
         return groups
 
-    header_row = table.find("tr", class_="headnote")
-    if not header_row:
-        thead = table.find("thead")
-        if thead:
-            header_row = thead.find("tr")
+    header_row = next(iter(_HEADNOTE_ROW_XP(table)), None)
+    if header_row is None:
+        thead = table.find(".//thead")
+        if thead is not None:
+            header_row = thead.find(".//tr")
 
     col_map = {}
-    if header_row:
-        for i, h in enumerate(header_row.find_all(["th", "td"])):
-            text = h.find(string=True, recursive=False)
-            text = text.strip().lower() if text else h.get_text(strip=True).lower()
+    if header_row is not None:
+        for i, h in enumerate(_HEADER_CELLS_XP(header_row)):
+            text = h.text if h.text else next((c.tail for c in h if c.tail), None)
+            text = text.strip().lower() if text else _text(h).lower()
             if text == "grupa":             col_map["grupa"] = i
             elif "prowadz" in text:         col_map["prowadzacy"] = i
             elif text == "termin":          col_map["termin"] = i
@@ -331,71 +632,97 @@ def get_groups(session, subject, rej_kod, cdyd_kod):
             elif "zapisanych" in text:      col_map["zapisanych"] = i
             elif "limit" in text and "rn" in text: col_map["limit"] = i
 
-    tbody = table.find("tbody")
-    rows = tbody.find_all("tr") if tbody else table.find_all("tr")
+    # Column indices resolved once per page (None = column missing)
+    columns = tuple(col_map.get(k) for k in
+                    ("grupa", "prowadzacy", "termin", "miejsce", "opis", "zapisanych", "limit"))
+
+    tbody = table.find(".//tbody")
+    rows = (tbody if tbody is not None else table).iter("tr")
 
     for row in rows:
-        if row.find("th") or "headnote" in (row.get("class") or []):
+        if row.find(".//th") is not None or "headnote" in (row.get("class") or "").split():
             continue
-        cells = row.find_all("td")
-        if len(cells) < 4:
+        cells = row.findall(".//td")
+        n_cells = len(cells)
+        if n_cells < 4:
             continue
 
-        def get_cell(key, default=""):
-            idx = col_map.get(key)
-            return cells[idx].get_text(separator=" ", strip=True) if idx is not None and idx < len(cells) else default
-
-        termin = get_cell("termin")
-        prowadzacy = get_cell("prowadzacy")
+        grupa, prowadzacy, termin, miejsce, opis, zapisanych, limit = (
+            _text(cells[i], " ") if i is not None and i < n_cells else "" for i in columns
+        )
         if not termin and not prowadzacy:
             continue
 
-        try:
-            zapisanych = int(re.sub(r"[^\d]", "", get_cell("zapisanych", "0")) or "0")
-        except ValueError:
-            zapisanych = 0
-        try:
-            limit = int(re.sub(r"[^\d]", "", get_cell("limit", "0")) or "0")
-        except ValueError:
-            limit = 0
-
-        for dzien, godz_start, godz_end in re.findall(
-            r"(\w+)\s+(\d{1,2}:\d{2})\s*-\s*(\d{1,2}:\d{2})", termin or ""
-        ):
-            groups.append({
-                "przedmiot": subject["name"],
-                "kod_przedmiotu": subject["code"],
-                "grupa": get_cell("grupa"),
-                "prowadzacy": prowadzacy,
-                "dzien": dzien,
-                "godz_start": godz_start,
-                "godz_end": godz_end,
-                "miejsce": get_cell("miejsce"),
-                "opis": get_cell("opis"),
-                "zapisanych": zapisanych,
-                "limit": limit,
-            })
+        zapisanych = _parse_count(zapisanych)
+        limit = _parse_count(limit)
+
+        for dzien, godz_start, godz_end in _TERMIN_RE.findall(termin):
+            groups.append(Group(
+                przedmiot=subject["name"],
+                kod_przedmiotu=subject["code"],
+                grupa=grupa,
+                prowadzacy=prowadzacy,
+                dzien=dzien,
+                godz_start=godz_start,
+                godz_end=godz_end,
+                miejsce=miejsce,
+                opis=opis,
+                zapisanych=zapisanych,
+                limit=limit,
+            ))
     return groups
 
 
 # --- State management ---
+# Group fields kept in the state file and compared between runs
+STATE_FIELDS = ("przedmiot", "grupa", "dzien", "godz_start", "godz_end",
+                "prowadzacy", "miejsce", "zapisanych", "limit", "wolne")
+_state_values = operator.attrgetter(*STATE_FIELDS)  # all of them in one C call
+
+
 def group_key(g):
-    return f"{g['kod_przedmiotu']}|gr{g['grupa']}|{g['dzien']}|{g['godz_start']}"
+    return f"{g.kod_przedmiotu}|gr{g.grupa}|{g.dzien}|{g.godz_start}"
 
 
 def load_previous_state(path):
+    """
+    Load the state saved by save_state as {group_key: {field: value}}.
+
+    Also accepts the older dict-of-dicts layout, so upgrading does not
+    re-announce every group as new.
+    """
     if path.exists():
         try:
-            with open(path, encoding="utf-8") as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
+            with open(path, "rb") as f:
+                data = orjson.loads(f.read())
+            if "rows" not in data:
+                return data
+            cols = data["cols"]
+            return {key: dict(zip(cols, row)) for key, row in zip(data["keys"], data["rows"])}
+        except (orjson.JSONDecodeError, IOError, KeyError, TypeError):
             pass
     return {}
 
 
 def save_state(path, state):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(state, f, ensure_ascii=False, indent=2)
+    """
+    Write state in a columnar layout (field names stored once, not per group).
+
+    The file is written to a temp file and renamed over the old one, so a
+    killed run never leaves a truncated state behind.
+    """
+    cols = list(next(iter(state.values()), {}))
+    data = {
+        "cols": cols,
+        "keys": list(state),
+        "rows": [[v[c] for c in cols] for v in state.values()],
+    }
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 if PRETTY_STATE else None))
+        f.flush()
+        os.fsync(f.fileno())  # data must hit the disk before the rename does
+    os.replace(tmp, path)
 
 
 # --- Main ---
@@ -414,68 +741,78 @@ def main():
     schedule = load_schedule_from_ics(SCHEDULE_FILE)
 
     # 2. Login
-    session = requests.Session()
-    session.headers.update({"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"})
-    if not cas_login(session):
-        send_notification("❌ Błąd logowania USOS", "Nie udało się zalogować. Sprawdź credentials.", 0xFF0000)
-        sys.exit(1)
+    session = create_session()
+    if not load_cookies(session, COOKIE_FILE):
+        if not cas_login(session):
+            send_notification("❌ Błąd logowania USOS", "Nie udało się zalogować. Sprawdź credentials.", 0xFF0000)
+            flush_notifications()
+            sys.exit(1)
+    save_cookies(session, COOKIE_FILE)  # also picks up cookies USOS rotated on a reused session
 
     # 3. Scrape
     if not REGISTRATIONS:
         print("BLAD: Lista REGISTRATIONS jest pusta. Odkomentuj przynajmniej jedną rejestrację.")
         sys.exit(1)
 
+    # Every registration's subject list, then every subject's groups, is queued
+    # up front so the pool stays busy across registrations; results are read
+    # back in order to keep the output and state deterministic.
     all_groups = []
-    for reg in REGISTRATIONS:
-        rej_kod = reg["rej_kod"]
-        print(f"\n=== {reg['name']} ({rej_kod}) ===")
-        subjects = get_subjects(session, rej_kod)
-        for i, subject in enumerate(subjects, 1):
-            print(f"  [{i}/{len(subjects)}] {subject['name']}")
-            all_groups.extend(get_groups(session, subject, rej_kod, CDYD_KOD))
-            time.sleep(0.3)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        subject_lists = list(pool.map(lambda reg: get_subjects(session, reg["rej_kod"]), REGISTRATIONS))
+        group_futures = [
+            [pool.submit(get_groups, session, subject, reg["rej_kod"], CDYD_KOD) for subject in subjects]
+            for reg, subjects in zip(REGISTRATIONS, subject_lists)
+        ]
+        for reg, subjects, futures in zip(REGISTRATIONS, subject_lists, group_futures):
+            print(f"\n=== {reg['name']} ({reg['rej_kod']}) ===")
+            print(f"  Znaleziono {len(subjects)} przedmiotow")
+            for i, (subject, future) in enumerate(zip(subjects, futures), 1):
+                print(f"  [{i}/{len(subjects)}] {subject['name']}")
+                all_groups.extend(future.result())
 
     print(f"\nGrup lacznie: {len(all_groups)}")
 
-    # 4. Filter conflicts
-    available = []
+    # 4. Filter conflicts and build state in one pass
+    # Only days some group actually meets on are kept; a new dict, since the
+    # loader's result is cached. dzien comes straight from _TERMIN_RE's \w+
+    # match, so it needs no strip(); days without classes skip the bisect.
+    group_days = {g.dzien for g in all_groups}
+    active_schedule = {day: slots for day, slots in schedule.items() if day in group_days}
+    current_state, available_with_spots = {}, []
     for g in all_groups:
-        g["wolne"] = g["limit"] - g["zapisanych"]
-        if not has_conflict(g, schedule):
-            available.append(g)
-
-    available_with_spots = [g for g in available if g["wolne"] > 0]
-    print(f"Bez kolizji: {len(available)}, z wolnymi miejscami: {len(available_with_spots)}")
-
-    # 5. Build state
-    current_state = {
-        group_key(g): {k: g[k] for k in
-            ("przedmiot", "grupa", "dzien", "godz_start", "godz_end",
-             "prowadzacy", "miejsce", "zapisanych", "limit", "wolne")}
-        for g in available
-    }
+        if has_conflict(g, active_schedule.get(g.dzien)):
+            continue
+        current_state[group_key(g)] = cur = dict(zip(STATE_FIELDS, _state_values(g)))
+        if cur["wolne"] > 0:
+            available_with_spots.append(cur)
+
+    print(f"Bez kolizji: {len(current_state)}, z wolnymi miejscami: {len(available_with_spots)}")
 
-    # 6. Compare
+    # 5. Compare
     prev_state = load_previous_state(STATE_FILE)
-    newly_available, spots_changed, newly_full = [], [], []
+    newly_available, spots_changed, newly_full = [], [], []  # spots_changed: (cur, prev_wolne)
 
     for key, cur in current_state.items():
+        wolne = cur["wolne"]
         prev = prev_state.get(key)
         if prev is None:
-            if cur["wolne"] > 0:
+            if wolne > 0:
                 newly_available.append(cur)
-        else:
-            prev_wolne = prev.get("wolne", 0)
-            if cur["wolne"] > 0 and prev_wolne == 0:
-                newly_available.append(cur)
-            elif cur["wolne"] == 0 and prev_wolne > 0:
-                newly_full.append(cur)
-            elif cur["wolne"] != prev_wolne and cur["wolne"] > 0:
-                spots_changed.append(cur)
+            continue
+        prev_wolne = prev.get("wolne", 0)
+        if wolne == prev_wolne:
+            continue  # the usual case: nothing to report for this group
+        if wolne > 0 and prev_wolne == 0:
+            newly_available.append(cur)
+        elif wolne == 0 and prev_wolne > 0:
+            newly_full.append(cur)
+        elif wolne > 0:
+            spots_changed.append((cur, prev_wolne))
 
     print(f"Zmiany: +{len(newly_available)} nowych, {len(spots_changed)} zmian, {len(newly_full)} zapelnionych")
 
-    # 7. Notify
+    # 6. Notify
     def group_field(g, prev_wolne=None):
         value = (f"📅 {g['dzien']} {g['godz_start']}-{g['godz_end']}\n"
                  f"👤 {g['prowadzacy']}\n")
@@ -505,13 +842,14 @@ def main():
             f"🔄 Zmiana miejsc ({len(spots_changed)})",
             "Zmieniła się liczba wolnych miejsc:",
             0x3399FF,
-            [group_field(g, prev_state.get(group_key(g), {}).get("wolne")) for g in spots_changed[:25]],
+            [group_field(g, prev_wolne) for g, prev_wolne in spots_changed[:25]],
         )
 
     if not newly_available and not newly_full and not spots_changed:
         print("Brak zmian od ostatniego sprawdzenia.")
+    flush_notifications()
 
-    # 8. Summary
+    # 7. Summary
     if available_with_spots:
         print("\n--- Dostepne (bez kolizji, wolne miejsca) ---")
         for g in available_with_spots: